@@ -32,6 +32,9 @@ ________________|Repeated as many as there are characters in code    |____
 See http://en.wikipedia.org/wiki/Kansas_City_standard
 """
 
+import os,re,struct,wave
+from pathlib import Path
+
 
 # A few global parameters related to the encoding
 
@@ -43,6 +46,8 @@ CENTER    = 128        # Center point of generated waves
 LEADER    = 14         # Default seconds for leader
 PARITY    = 0          # Parity 0 = Odd, 1 = Even
 STARTBIT  = 0          # Start Bit
+WRITE_BUFFER = 1 << 20 # Bytes of output buffering for WAV files
+LEADER_CHUNK = 1 << 16 # Bytes of leader written per call
 
 # Return list of relevant text files from a directory
 def GetFiles(directory,extensions):
@@ -55,129 +60,165 @@ def GetFiles(directory,extensions):
 
 # Create a single square wave cycle of a given frequency
 def make_square_wave(freq,framerate):
-    n = int(framerate/freq/2)
-    return bytearray([CENTER-AMPLITUDE//2])*n + \
-           bytearray([CENTER+AMPLITUDE//2])*n
+    n = framerate//freq//2
+    return bytes([CENTER-AMPLITUDE//2])*n + \
+           bytes([CENTER+AMPLITUDE//2])*n
+
+# Wave patterns that encode 1s and 0s, built by build_pulse_table
+one_pulse  = b''
+zero_pulse = b''
 
-# Create the wave patterns that encode 1s and 0s
-one_pulse  = make_square_wave(ONES_FREQ,FRAMERATE) 
-zero_pulse = make_square_wave(ZERO_FREQ,FRAMERATE) 
+# Lookup table of the complete waveform (start bit, 8 data bits and parity)
+# for every possible byte value
+PULSE_TABLE = [None]*256
 
-def is_even(number):
-    return number % 2 == 0
+# Leader and trailer waveforms, shared by every file of a batch. The leader
+# is kept as a chunk of whole cycles written leader_chunks times followed by
+# the remaining cycles, rather than as one large object.
+leader_chunk  = b''
+leader_chunks = 0
+leader_tail   = b''
+trailer_wave  = b''
+
+# Line label followed by the code, leading blanks of the code are skipped
+_LINE_RE = re.compile(r"^(\d+)\s*(.*)$")
 
 def Extract_Number_String(text):
-    match = re.match(r"^(\d+)(.*)", text)
+    match = _LINE_RE.match(text)
     if match:
         number_str, remaining_str = match.groups()
-        return int(number_str), remaining_str.lstrip()
+        return int(number_str), remaining_str
     else:
         return None, text
 
 
 def Create_BinData(SourceFile):        
     with open(SourceFile, 'r', encoding='utf-8') as file:
-        text_content = file.read()
-        text_segment = text_content.split('\n')   # Line and Code
-        indexed_data = {i: seg for i, seg in enumerate(text_segment)}
-        byte_size= 0
-        code_array = []
-        start_array=[]
-        # Split line into label and code
-        for i in range(len(indexed_data)):
-            label,code=Extract_Number_String(indexed_data[i])
+        code_array = bytearray(2)   # start sequence, filled in once the size is known
+        # Read line by line rather than holding the whole file in memory
+        # and split each line into label and code
+        for line in file:
+            label,code=Extract_Number_String(line.rstrip('\n'))
             if label==None:
                 continue
             code=code+"\r"
             #labelcode=str(label)+code
-            byte_code = code.encode('utf-8')      # Encode the string to bytes using UTF-8
-            label_byte=bin(label)[2:].zfill(16)
-            code_array.append(label_byte[0:8]) 
-            code_array.append(label_byte[8:])
-
-            for byte in byte_code:
-                # Convert each byte to its 8-bit binary representation and append each bit (as an integer) to the binary array
-                code_array.append(bin(byte)[2:].zfill(8)) 
-    byte_size=len(code_array)
-    code_array.append(bin(0)[2:].zfill(8)) # terminating sequence and not included in byte size calculation
+            code_array.append((label >> 8) & 0xFF)   # label high byte
+            code_array.append(label & 0xFF)          # label low byte
+            code_array.extend(code.encode('utf-8'))  # Encode the string to bytes using UTF-8
+    byte_size=len(code_array)-2
+    code_array.append(0) # terminating sequence and not included in byte size calculation
    
-    start=bin(byte_size+256)[2:].zfill(16) # start at 0x100          
-    start_array.append(start[0:8])         # start sequence with byte 1
-    start_array.append(start[8:])          # start sequence with byte 2
-    binary_array=[]
-    binary_array.extend(start_array)
-    binary_array.extend(code_array)
-    return binary_array
+    start=byte_size+256  # start at 0x100          
+    code_array[0]=(start >> 8) & 0xFF      # start sequence with byte 1
+    code_array[1]=start & 0xFF             # start sequence with byte 2
+    return code_array
    
-# Take a single byte value and turn it into a bytearray representing
-# the associated waveform along with the required start and stop bits.
-def Encode_Data(bytes):
+# Rebuild the wave patterns, the leader/trailer and the byte waveform lookup
+# table from the current parameters. Must be called again whenever the
+# frequencies, framerate, amplitude, leader, start bit or parity are changed.
+def build_pulse_table():
+    global one_pulse, zero_pulse, leader_chunk, leader_chunks, leader_tail, trailer_wave
+    # Work on locals, the loop below would otherwise look up globals
+    one    = make_square_wave(ONES_FREQ,FRAMERATE)
+    zero   = make_square_wave(ZERO_FREQ,FRAMERATE)
+    parity = PARITY
+    table  = PULSE_TABLE
+    cycles        = int(FRAMERATE/len(one))*LEADER
+    chunk_cycles  = max(1,LEADER_CHUNK//len(one))
+    leader_chunk  = one*chunk_cycles
+    leader_chunks = cycles//chunk_cycles
+    leader_tail   = one*(cycles % chunk_cycles)
+    trailer_wave  = zero*3
     # The start bit (0 or 1)
-    if (STARTBIT==0):
-        encoded = bytearray(zero_pulse)
-    else:
-        encoded = bytearray(one_pulse)
-    p = 0
-    # 8 data bits
-    for bit in bytes:
-        if (int(bit)==1):
-            encoded.extend(one_pulse)
-            p=p+1
-        else:
-            encoded.extend(zero_pulse)
-            
-    # add parity
-    
-    if (PARITY==0):
-        if (p==0) or is_even(p):
-            encoded.extend(one_pulse)   
-        else:
-            encoded.extend(zero_pulse)   
-    else:
-        if is_even(p)==0:
-            encoded.extend(one_pulse)        
-        else:
-            encoded.extend(zero_pulse)
-    return encoded
+    start_pulse = zero if STARTBIT==0 else one
+    for v in range(256):
+        # 8 data bits, most significant first
+        parts = [start_pulse]
+        parts.extend(one if v & (1 << (7-i)) else zero for i in range(8))
+        # add parity, the bit is set when it brings the count of ones to
+        # odd (PARITY 0) or even (PARITY 1)
+        parts.append(one if (v.bit_count() & 1) == parity else zero)
+        table[v] = b''.join(parts)
+    one_pulse, zero_pulse = one, zero
 
+build_pulse_table()
 
-# Write Tag
-def Write_Tag(filename,text1):
-    with taglib.File(filename) as file:
-        file.tags["ARTIST"] = [text1]    
-        file.tags["ALBUM"] = [text1]
-        file.tags["TITLE"] = [text1]
-        file.save()
+
+# Build a RIFF LIST INFO chunk setting artist, title and product (album)
+# to the given text
+def Make_Tag(text1):
+    value = text1.encode('utf-8') + b'\0'
+    size  = len(value)
+    if size & 1:
+        value = value + b'\0'                  # sub-chunks are word aligned
+    info = b'INFO'
+    for key in (b'IART',b'INAM',b'IPRD'):
+        info = info + struct.pack('<4sL',key,size) + value
+    return struct.pack('<4sL',b'LIST',len(info)) + info
 
 
 # Write a WAV file with encoded data. leader and trailer specify the
-# number of seconds of carrier signal to encode before and after the data
-def Write_Wav(TargetFile,Binary_Data):
-    w = wave.open(TargetFile,"wb")
-    w.setnchannels(1)
-    w.setsampwidth(1)
-    w.setframerate(FRAMERATE)
-
-    # Write the leader
-    w.writeframes(one_pulse*(int(FRAMERATE/len(one_pulse))*LEADER))
-    # Encode the actual data
-    for byte in Binary_Data:
-        w.writeframes(Encode_Data(byte))
-  
-    for x in range(3):
-        w.writeframes(zero_pulse) 
-    w.close()
+# number of seconds of carrier signal to encode before and after the data.
+# When a title is given it is tagged inline as RIFF INFO metadata.
+def Write_Wav(TargetFile,Binary_Data,Title=None):
+    # Write through a 1 MiB buffer to keep the number of system calls low
+    with open(TargetFile,"wb",buffering=WRITE_BUFFER) as file:
+        w = wave.open(file,"wb")
+        try:
+            w.setnchannels(1)
+            w.setsampwidth(1)
+            w.setframerate(FRAMERATE)
+
+            # Size the file up front so the header is written once with its
+            # final lengths and never has to be patched, then write the leader,
+            # the encoded data and the trailer without joining them together
+            table   = PULSE_TABLE
+            payload = b''.join([table[v] for v in Binary_Data])
+            w.setnframes(len(leader_chunk)*leader_chunks+len(leader_tail)+len(payload)+len(trailer_wave))
+            for x in range(leader_chunks):
+                w.writeframesraw(leader_chunk)
+            w.writeframesraw(leader_tail)
+            w.writeframesraw(payload)
+            w.writeframesraw(trailer_wave)
+        finally:
+            w.close()
+
+        if Title is not None:
+            if file.tell() & 1:
+                file.write(b'\0')                # chunks start on even offsets
+            file.write(Make_Tag(Title))
+            size = file.tell()
+            file.seek(4)                         # RIFF size covers the new chunk
+            file.write(struct.pack('<L',size-8))
+
+# Set the encoding parameters chosen at the prompts in a worker process
+# and rebuild its waveforms once
+def Init_Worker(params):
+    global ONES_FREQ,ZERO_FREQ,FRAMERATE,AMPLITUDE,LEADER,STARTBIT,PARITY
+    ONES_FREQ,ZERO_FREQ,FRAMERATE,AMPLITUDE,LEADER,STARTBIT,PARITY = params
+    build_pulse_table()
+
+# Convert a single text file into a tagged WAV file
+def Convert_File(SourceFile,TargetFile):
+    Binary_Data=Create_BinData(SourceFile)
+    Write_Wav(TargetFile,Binary_Data,Path(TargetFile).resolve().stem)
+    return TargetFile
 
 if __name__ == '__main__':
+    from multiprocessing import freeze_support
+
+    # Must come first, frozen executables start pool workers through here
+    freeze_support()
     import sys
     
     if len(sys.argv) != 1:
         print("Usage : %s" % sys.argv[0],file=sys.stderr)
         raise SystemExit(1)
 
-    import click,os,glob,re,taglib,wave
+    import click,glob
     from colorama import Fore, Back, Style, init
-    from pathlib import Path
+    from concurrent.futures import ProcessPoolExecutor
        
     os.system('cls')
     init(autoreset=True)
@@ -201,6 +242,7 @@ if __name__ == '__main__':
     LEADER    = int(click.prompt(f'{Fore.YELLOW}Leader in seconds' ,default=str(LEADER),type=click.IntRange(0, 60),hide_input=False,show_default=False,prompt_suffix=' <'+str(LEADER)+'> :'))
     STARTBIT  = int(click.prompt(f'{Fore.YELLOW}Start Bit 0 or 1',default=str(STARTBIT),type=click.IntRange(0, 1),hide_input=False,show_default=False,prompt_suffix=' <'+str(STARTBIT)+'> :'))
     PARITY    = int(click.prompt(f'{Fore.YELLOW}Parity (0 Odd) or (1 Even)',default=str(PARITY),type=click.IntRange(0, 1),hide_input=False,show_default=False,prompt_suffix=' <'+str(PARITY)+'> :'))
+    params    = (ONES_FREQ,ZERO_FREQ,FRAMERATE,AMPLITUDE,LEADER,STARTBIT,PARITY)
     
     AlphaDir = click.confirm(f'{Fore.MAGENTA}\nDo you want to save files in alphabetized directories ?',default='Y')
     Extension = ['.txt','.text']
@@ -216,6 +258,9 @@ if __name__ == '__main__':
         
             
     if click.confirm(f'{Fore.RED}{Back.BLACK}\nProceed ?',default='Y'):
+        # Target file per normalized path, sources sharing a target are
+        # converted only once and the last one wins as when run in sequence
+        Targets = {}
         for SourceFile in Files_Found:    
             FileName=os.path.splitext(os.path.basename(SourceFile))[0]
             AlphaName=FileName[0].upper()
@@ -230,12 +275,16 @@ if __name__ == '__main__':
                         os.makedirs(WavDir)    
             
             TargetFile=os.path.join(WavDir, FileName +'.wav')         
-            Binary_Data=Create_BinData(SourceFile)
-            FName=Path(TargetFile).resolve().stem
+            Key=os.path.normcase(TargetFile)
+            if Key in Targets:
+                print(f'{Fore.RED}{os.path.basename(Targets[Key][0])} skipped, {os.path.basename(SourceFile)} also writes {TargetFile}')
+            Targets[Key]=(SourceFile,TargetFile)
             
-            print(f'{Fore.YELLOW}Creating File {TargetFile}')
-            Write_Wav(TargetFile,Binary_Data)
-            Write_Tag(TargetFile,FName)
+        # Every target is now written by a single source so convert them in parallel
+        Sources,Target_Files = zip(*Targets.values())
+        with ProcessPoolExecutor(initializer=Init_Worker,initargs=(params,)) as executor:
+            for TargetFile in executor.map(Convert_File,Sources,Target_Files):
+                print(f'{Fore.YELLOW}Created File {TargetFile}')
     else:
         click.pause(f'{Fore.RED}{Style.BRIGHT}\nABORTED. Press the any key to exit')
         sys.exit()
\ No newline at end of file